@@ -1,14 +1,24 @@
 # caf.py — CAF Extractor (Forms + Text + OCR, y-position row mapping)
 # Run: streamlit run caf.py
 
+import logging
+import math
+import os
 import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from bisect import bisect_left
+from itertools import groupby
 from io import BytesIO
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Tuple, Any, Callable, Iterator, NamedTuple
 import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 import fitz  # PyMuPDF
-from pdf2image import convert_from_bytes
 import pytesseract
 import numpy as np
 from PIL import Image
@@ -19,6 +29,43 @@ try:
 except Exception:
     pass
 
+# Optional: tesserocr runs libtesseract in-process (no subprocess per batch);
+# pytesseract is used when it isn't installed
+try:
+    from tesserocr import PyTessBaseAPI, OEM, PSM
+except ImportError:
+    PyTessBaseAPI = None
+
+logger = logging.getLogger(__name__)
+
+# Optional: EasyOCR, used instead of tesseract only when a CUDA GPU is present.
+# A broken torch/CUDA install can fail with more than ImportError, either on
+# import or in the device probe; any failure just means tesseract is used.
+try:
+    import easyocr
+    import torch
+    EASYOCR_GPU = torch.cuda.is_available()
+except Exception:
+    EASYOCR_GPU = False
+
+# CAF_DEBUG=1 keeps per-row debug columns (signature flags, row y) in PATH B output
+DEBUG = os.getenv("CAF_DEBUG") == "1"
+
+# OCR settings: 200 DPI greyscale is enough for typed CAF text and is ~2.25x
+# fewer pixels than 300 DPI; LSTM engine only, page read as one text block.
+OCR_DPI = 200
+# ...but if the fallback text has no course lines at all, every page is OCR'd
+# once more at this DPI
+OCR_RETRY_DPI = 300
+OCR_LANG = "eng"
+OCR_CONFIG = "--oem 1 --psm 6"
+# ocr_pool runs at most one tesseract process per core; keep each one single
+# threaded so OpenMP inside tesseract doesn't oversubscribe the CPUs
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+# A page whose own text layer is this short (scanner stamps, stray labels) is
+# treated as scanned and OCR'd; longer pages keep their text layer
+PAGE_TEXT_MIN_CHARS = 100
+
 # ---------------- Streamlit page config ----------------
 st.set_page_config(page_title="CAF Extractor (Robust)", layout="wide")
 st.title("Course Approval Form → Table")
@@ -28,19 +75,91 @@ st.caption(
 )
 
 # ---------------- Utilities ----------------
+# PDF helpers keyed on pdf_bytes use st.cache_data: Streamlit re-runs the script
+# on every interaction, so repeat calls for the same upload skip the re-parse.
+
+BLANK_RUN_RE = re.compile(r"[ \t]+")
+ODD_SPACE_RE = re.compile(r"[\u200b\ufeff\u00a0]")
+LINK_TAIL_RE = re.compile(r"\s*Link to course description.*$", re.I)
+
 def norm_space(s: str) -> str:
     s = (s or "").strip()
-    s = re.sub(r"[ \t]+", " ", s)
-    s = re.sub(r"[\u200b\ufeff\u00a0]", " ", s)
+    s = BLANK_RUN_RE.sub(" ", s)
+    s = ODD_SPACE_RE.sub(" ", s)
     return s
 
+# widget/field values repeat a lot (blank boxes, "No", "N/A"), and the same
+# value is normalized again by the header and row code. Whole-document text
+# goes through the uncached norm_space so this cache never pins full documents.
+@lru_cache(maxsize=4096)
+def norm_value(s: str) -> str:
+    return norm_space(s)
+
 def clean_course_text(t: str) -> str:
     # Remove trailing "Link to course description" style text and collapse spaces
     t = t.replace("\n", " ").strip()
-    t = re.sub(r"\s*Link to course description.*$", "", t, flags=re.I)
-    t = re.sub(r"\s+", " ", t)
+    # most lines have no link tail; for ASCII text lower() agrees with re.I, so
+    # a substring test can skip the regex (non-ASCII always takes the regex)
+    if not t.isascii() or "link to course description" in t.lower():
+        t = LINK_TAIL_RE.sub("", t)
+    # str.split() splits on the same characters as \s, so this collapses
+    # every whitespace run to one space (t has no edge whitespace left)
+    t = " ".join(t.split())
     return t.strip(" -:")
 
+# (pattern, formatter) rules for parse_course_code_and_title, in priority order.
+# Each formatter receives the rule's own groups and returns (course_code, course_title).
+COURSE_PATTERNS: List[Tuple[str, Callable[[Tuple[str, ...]], Tuple[str, str]]]] = [
+    # "(GI) Econ 3006 PRCZ Economics of the European Union"
+    (r"^\(([A-Z]+)\)\s+([A-Za-z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4})\s+(.+)$",
+     lambda g: (f"({g[0]}) {g[1]}", g[2])),
+    # Variant with separated subject and code blocks
+    (r"^\(([A-Z]+)\)\s+([A-Z]{2,4})\s+(\d{2,4}\s+[A-Z]{2,4})\s+(.+)$",
+     lambda g: (f"({g[0]}) {g[1]} {g[2]}", g[3])),
+    # "POLI 3003 PRAG The Rise and Fall ..."
+    (r"^([A-Z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4})\s+(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+    # "CU 270: Culture and Cuisine"
+    (r"^([A-Z]{2,4}\s+\d{2,4}[A-Z]?)\s*:\s*(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+    # "CU 270-01 - 2163268-Culture and Cuisine"
+    (r"^([A-Z]{2,4}\s+\d{2,4}(?:-\d{2})?)\s*-\s*(\d{7})-(.+)$",
+     lambda g: (g[0].strip(), g[2].strip())),
+    # "BOCCONI 30150 - Introduction to Options and Futures"
+    (r"^([A-Z]{2,8}\s+\d{2,5})\s*-\s*(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+    # "FI 356 - International Financial Markets and Investments"
+    (r"^([A-Z]{2,4}\s+\d{2,4})\s*-\s*(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+    # "BBLCO1221U – Corporate Finance" (en dash / hyphen)
+    (r"^([A-Z]{2,10}(?:-[A-Z0-9]+)*[A-Z0-9]+)\s*[–-]\s*(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+    # "BA-BHAAV1058U Management Accounting ..."
+    (r"^([A-Z]{2,10}(?:-[A-Z0-9]+)*[A-Z0-9]+)\s+(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+    # "ASIA2041 - Mainland Southeast Asia"
+    (r"^([A-Z]{1,4}(?:/[A-Z]{1,4})?\s*\d{2,3}[A-Z]?)\s*[-–]\s*(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+    # "PO/EC 246 European Union Policies in Practice"
+    (r"^([A-Z]{1,4}/[A-Z]{1,4}\s+\d{2,4})\s+(.+)$",
+     lambda g: (g[0].strip(), g[1].strip())),
+]
+
+# All rules fused into one alternation: the first alternative that matches wins,
+# exactly like trying them one by one, but the input is only walked once.
+COURSE_RE = re.compile("|".join(f"(?P<p{i}>{pat})" for i, (pat, _) in enumerate(COURSE_PATTERNS)))
+
+# named group -> (slice of that rule's own groups within m.groups(), formatter)
+COURSE_DISPATCH: Dict[str, Tuple[slice, Callable[[Tuple[str, ...]], Tuple[str, str]]]] = {
+    name: (slice(start, start + re.compile(pat).groups), fmt)
+    for (pat, fmt), (name, start) in zip(COURSE_PATTERNS, COURSE_RE.groupindex.items())
+}
+
+# Fallback: guess first token is code
+COURSE_CODE_GUESS_RE = re.compile(r"^([A-Z]{2,10}(?:-[A-Z0-9]+)*[A-Z0-9]+)")
+
+# pure function of the course string; bulk uploads see the same courses again
+@lru_cache(maxsize=4096)
 def parse_course_code_and_title(course_text: str) -> tuple:
     """
     Try to split a raw line like:
@@ -55,72 +174,12 @@ def parse_course_code_and_title(course_text: str) -> tuple:
 
     text = course_text.strip()
 
-    # Pattern: "(GI) Econ 3006 PRCZ Economics of the European Union"
-    match1 = re.match(r"^\(([A-Z]+)\)\s+([A-Za-z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4})\s+(.+)$", text)
-    if match1:
-        prefix = match1.group(1)
-        code = match1.group(2)
-        title = match1.group(3)
-        return f"({prefix}) {code}", title
-
-    # Variant with separated subject and code blocks
-    match1a = re.match(r"^\(([A-Z]+)\)\s+([A-Z]{2,4})\s+(\d{2,4}\s+[A-Z]{2,4})\s+(.+)$", text)
-    if match1a:
-        prefix = match1a.group(1)
-        subj = match1a.group(2)
-        code_part = match1a.group(3)
-        title = match1a.group(4)
-        return f"({prefix}) {subj} {code_part}", title
-
-    # Pattern: "POLI 3003 PRAG The Rise and Fall ..."
-    match2 = re.match(r"^([A-Z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4})\s+(.+)$", text)
-    if match2:
-        return match2.group(1).strip(), match2.group(2).strip()
-
-    # Pattern: "CU 270: Culture and Cuisine"
-    match3 = re.match(r"^([A-Z]{2,4}\s+\d{2,4}[A-Z]?)\s*:\s*(.+)$", text)
-    if match3:
-        return match3.group(1).strip(), match3.group(2).strip()
-
-    # Pattern: "CU 270-01 - 2163268-Culture and Cuisine"
-    match4 = re.match(r"^([A-Z]{2,4}\s+\d{2,4}(?:-\d{2})?)\s*-\s*(\d{7})-(.+)$", text)
-    if match4:
-        code = match4.group(1).strip()
-        title = match4.group(3).strip()
-        return code, title
+    m = COURSE_RE.match(text)
+    if m:
+        groups, fmt = COURSE_DISPATCH[m.lastgroup]
+        return fmt(m.groups()[groups])
 
-    # Pattern: "BOCCONI 30150 - Introduction to Options and Futures"
-    match4b = re.match(r"^([A-Z]{2,8}\s+\d{2,5})\s*-\s*(.+)$", text)
-    if match4b:
-        return match4b.group(1).strip(), match4b.group(2).strip()
-
-    # Pattern: "FI 356 - International Financial Markets and Investments"
-    match4c = re.match(r"^([A-Z]{2,4}\s+\d{2,4})\s*-\s*(.+)$", text)
-    if match4c:
-        return match4c.group(1).strip(), match4c.group(2).strip()
-
-    # Pattern: "BBLCO1221U – Corporate Finance" (en dash / hyphen)
-    match4a = re.match(r"^([A-Z]{2,10}(?:-[A-Z0-9]+)*[A-Z0-9]+)\s*[–-]\s*(.+)$", text)
-    if match4a:
-        return match4a.group(1).strip(), match4a.group(2).strip()
-
-    # Pattern: "BA-BHAAV1058U Management Accounting ..."
-    match5 = re.match(r"^([A-Z]{2,10}(?:-[A-Z0-9]+)*[A-Z0-9]+)\s+(.+)$", text)
-    if match5:
-        return match5.group(1).strip(), match5.group(2).strip()
-
-    # Pattern: "ASIA2041 - Mainland Southeast Asia"
-    match6 = re.match(r"^([A-Z]{1,4}(?:/[A-Z]{1,4})?\s*\d{2,3}[A-Z]?)\s*[-–]\s*(.+)$", text)
-    if match6:
-        return match6.group(1).strip(), match6.group(2).strip()
-
-    # Pattern: "PO/EC 246 European Union Policies in Practice"
-    match6a = re.match(r"^([A-Z]{1,4}/[A-Z]{1,4}\s+\d{2,4})\s+(.+)$", text)
-    if match6a:
-        return match6a.group(1).strip(), match6a.group(2).strip()
-
-    # Fallback: guess first token is code
-    code_guess = re.match(r"^([A-Z]{2,10}(?:-[A-Z0-9]+)*[A-Z0-9]+)", text)
+    code_guess = COURSE_CODE_GUESS_RE.match(text)
     if code_guess:
         code = code_guess.group(1).strip()
         title = text.replace(code, "").strip(" -:").strip()
@@ -128,8 +187,79 @@ def parse_course_code_and_title(course_text: str) -> tuple:
 
     return "", text
 
+# Approval-box values that are answers, not initials/signatures
+NON_SIG_VALUES = frozenset({"", "no", "n", "none", "yes", "y", "approved", "denied", "na", "n/a"})
+# Approval field values that do not count as an approval
+EMPTY_APPROVAL_VALUES = frozenset({"", "no", "n", "none"})
+SIGNATURE_PUNCT = (".", ",", " ")
+
+def literal_alternation(terms: Tuple[str, ...]) -> "re.Pattern":
+    """
+    One compiled pattern that matches any of the literal substrings in terms.
+    """
+    return re.compile("|".join(re.escape(t) for t in terms))
+
+# Comment terms used by map_approval_type_from_signatures, by category
+COMMENT_TERMS = {
+    "codes": ("intr:", "ppd", "gon", "pac"),
+    "not_approved": ("not approved", "denied", "rejected"),
+    "elective": ("elective", "general elective", "elective only"),
+    "major_minor": ("major", "minor", "major/minor"),
+}
+# One pass over the comment finds every category. The alternation sits in a
+# lookahead so matches don't consume text and overlapping terms are still seen;
+# no two categories have a term that can match at the same position.
+COMMENT_TERMS_RE = re.compile("(?=(?:" + "|".join(
+    "(?P<%s>%s)" % (cat, literal_alternation(terms).pattern)
+    for cat, terms in COMMENT_TERMS.items()
+) + "))")
+
+@lru_cache(maxsize=1024)
+def comment_categories(c_low: str) -> frozenset:
+    """
+    COMMENT_TERMS categories with at least one term in the lower-cased comment.
+    """
+    return frozenset(m.lastgroup for m in COMMENT_TERMS_RE.finditer(c_low))
+
+APPROVAL_NAME_RE = re.compile(r"elec|major|minor")
+
+def approval_kind(widget_name: str) -> str:
+    """
+    Classify a lower-cased widget name as an approval box:
+    "elective", "major_minor", or "" when it is not one.
+    """
+    if not APPROVAL_NAME_RE.search(widget_name):
+        return ""
+    return "elective" if "elec" in widget_name else "major_minor"
+
+def approval_widgets_by_page(widgets: List["Widget"]) -> Dict[int, List["Widget"]]:
+    """
+    Elective / major-minor approval widgets grouped by page, in form order.
+    """
+    by_page: Dict[int, List["Widget"]] = {}
+    for w in widgets:
+        if approval_kind(w.name.lower()):
+            by_page.setdefault(w.page, []).append(w)
+    return by_page
+
+def widget_columns(widgets: List["Widget"]) -> Dict[str, Any]:
+    """
+    Column-wise copy of the approval widgets for per-row proximity queries:
+    NumPy arrays for page/y0 plus parallel lists of names, kinds and values.
+    Other widgets never affect the signature flags, so they are left out.
+    """
+    widgets = [w for ws in approval_widgets_by_page(widgets).values() for w in ws]
+    names = [w.name.lower() for w in widgets]
+    return {
+        "page": np.array([w.page for w in widgets], dtype=np.int32),
+        "y0": np.array([w.y0 for w in widgets], dtype=np.float64),
+        "name": names,
+        "kind": [approval_kind(n) for n in names],
+        "value": [w.value.strip() for w in widgets],
+    }
+
 def detect_signature_in_widgets(
-    widgets: List[Dict],
+    widget_cols: Dict[str, Any],
     course_y: float,
     page: int,
     y_tolerance: float = 15.0
@@ -138,40 +268,33 @@ def detect_signature_in_widgets(
     Look at PDF widgets close to the course row.
     Decide if those widgets look like they contain a signature
     (elective vs major/minor).
+    widget_cols comes from widget_columns().
     """
     signature_detected = {"elective": False, "major_minor": False}
 
-    for widget in widgets:
-        if widget["page"] != page:
-            continue
-        if abs(widget["y0"] - course_y) > y_tolerance:
-            continue
-
-        widget_name = (widget["name"] or "").lower()
-        widget_value = (widget["value"] or "").strip()
+    near = (widget_cols["page"] == page) & (np.abs(widget_cols["y0"] - course_y) <= y_tolerance)
+    for i in np.flatnonzero(near):
+        widget_value = widget_cols["value"][i]
+        kind = widget_cols["kind"][i]
 
         has_signature = False
 
         # text in the box that looks like initials/names (not just No/N/A/etc.)
         if widget_value:
-            non_sig_values = ["", "no", "n", "none", "yes", "y", "approved", "denied", "na", "n/a"]
-            if widget_value.lower().strip() not in non_sig_values:
+            if widget_value.lower() not in NON_SIG_VALUES:
                 if (
-                    len(widget_value.strip()) > 1
-                    and (any(c.isalpha() for c in widget_value) or any(c in widget_value for c in [".", ",", " "]))
+                    len(widget_value) > 1
+                    and (any(c.isalpha() for c in widget_value) or any(c in widget_value for c in SIGNATURE_PUNCT))
                 ):
                     has_signature = True
 
         # heuristic: if the widget name itself implies an approval box
-        if not has_signature and widget_name:
-            if "elec" in widget_name or "major" in widget_name or "minor" in widget_name:
-                has_signature = True
+        if not has_signature and kind:
+            has_signature = True
 
         # map
-        if "elec" in widget_name and has_signature:
-            signature_detected["elective"] = True
-        elif ("major" in widget_name or "minor" in widget_name) and has_signature:
-            signature_detected["major_minor"] = True
+        if kind and has_signature:
+            signature_detected[kind] = True
 
     return signature_detected
 
@@ -186,6 +309,8 @@ def map_approval_type_from_signatures(
     "Elective", "Major, Minor", "Not Approved", etc.
     """
     result = []
+    c_low = comments.lower() if comments else ""
+    found = comment_categories(c_low) if c_low else frozenset()
 
     # Priority 1: visual/structural signatures near row
     if signature_detected["elective"] and elective_approval:
@@ -194,27 +319,25 @@ def map_approval_type_from_signatures(
         result.append("Major, Minor")
 
     # Priority 2: comments with patterns
-    if not result and comments:
-        c_low = comments.lower()
-        if any(term in c_low for term in ["intr:", "ppd", "gon", "pac"]):
+    if not result and c_low:
+        if "codes" in found:
             result.append("Major, Minor")
 
     # Priority 3: fallback to field values
     if not result:
-        if elective_approval and elective_approval.strip().lower() not in ["", "no", "n", "none"]:
+        if elective_approval and elective_approval.strip().lower() not in EMPTY_APPROVAL_VALUES:
             result.append("Elective")
-        if major_minor_approval and major_minor_approval.strip().lower() not in ["", "no", "n", "none"]:
+        if major_minor_approval and major_minor_approval.strip().lower() not in EMPTY_APPROVAL_VALUES:
             result.append("Major, Minor")
 
     # Priority 4: comments override (Not Approved)
-    if comments:
-        c_low = comments.lower()
-        if any(term in c_low for term in ["not approved", "denied", "rejected"]):
+    if c_low:
+        if "not_approved" in found:
             result = ["Not Approved"]
         elif not result:
-            if any(term in c_low for term in ["elective", "general elective", "elective only"]):
+            if "elective" in found:
                 result.append("Elective")
-            elif any(term in c_low for term in ["major", "minor", "major/minor"]):
+            elif "major_minor" in found:
                 result.append("Major, Minor")
 
     # Final merge
@@ -223,7 +346,66 @@ def map_approval_type_from_signatures(
 TERM_RE = re.compile(r"\b(fall|spring|summer|winter)\b", re.I)
 DATE_RE = re.compile(r"\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b")
 YEAR_RE = re.compile(r"\b(19|20)\d{2}\b")
-
+URL_RE = re.compile(r"https?://", re.I)
+PERSON_NAME_RE = re.compile(r"^[A-Za-z][A-Za-z .'-]+ [A-Za-z][A-Za-z .'-]+$")
+STUDENT_ID_RE = re.compile(r"^\d{5,10}$")
+CLASS_YEAR_RE = re.compile(r"^\d{4}$")
+PROGRAM_HINT_RE = re.compile(
+    r"(university|college|institute|institut|academy|exchange|ciee|ies abroad|study abroad|business school)",
+    re.I
+)
+# field keys that are clearly not a provider/university
+PROGRAM_KEY_AVOID_RE = literal_alternation((
+    "course", "comment", "equiv", "approve", "majorminor",
+    "class", "semester", "id", "date", "name", "signature",
+    "advisor", "chair", "dean"
+))
+BLOCK_PROGRAM_HINT_RE = re.compile(r"(university|college|institute|ciee|ies abroad|exchange|business school)", re.I)
+BLOCK_PROGRAM_AVOID_RE = re.compile(r"(course|subject|number|title|instructions|advisor|signature)", re.I)
+
+CITY_COUNTRY_MAP = {
+    "milan": ("Milan", "Italy"),
+    "barcelona": ("Barcelona", "Spain"),
+    "madrid": ("Madrid", "Spain"),
+    "london": ("London", "United Kingdom"),
+    "paris": ("Paris", "France"),
+    "florence": ("Florence", "Italy"),
+    "rome": ("Rome", "Italy"),
+    "prague": ("Prague", "Czech Republic"),
+    "copenhagen": ("Copenhagen", "Denmark"),
+    "stockholm": ("Stockholm", "Sweden"),
+    "dublin": ("Dublin", "Ireland"),
+    "amsterdam": ("Amsterdam", "Netherlands"),
+    "berlin": ("Berlin", "Germany"),
+    "tokyo": ("Tokyo", "Japan"),
+    "sydney": ("Sydney", "Australia"),
+    "buenos aires": ("Buenos Aires", "Argentina"),
+    "cape town": ("Cape Town", "South Africa"),
+    "hong kong": ("Hong Kong", "China"),
+    "singapore": ("Singapore", "Singapore"),
+    "seoul": ("Seoul", "South Korea"),
+    "kyoto": ("Kyoto", "Japan"),
+    "nagoya": ("Nagoya", "Japan"),
+    "waseda": ("Tokyo", "Japan"),
+    "yonsei": ("Seoul", "South Korea"),
+    "leeds": ("Leeds", "United Kingdom"),
+    "bristol": ("Bristol", "United Kingdom"),
+    "york": ("York", "United Kingdom"),
+    "auckland": ("Auckland", "New Zealand"),
+    "cairo": ("Cairo", "Egypt"),
+    "munich": ("Munich", "Germany"),
+    "christchurch": ("Christchurch", "New Zealand"),
+    "birmingham": ("Birmingham", "United Kingdom"),
+}
+
+# One pass over the lower-cased program text instead of a substring test per
+# city. The alternation sits in a lookahead so every occurrence of every key is
+# seen (matches don't consume text); the key earliest in CITY_COUNTRY_MAP wins,
+# as with the original in-order substring tests.
+CITY_RE = re.compile("(?=(" + "|".join(re.escape(k) for k in CITY_COUNTRY_MAP) + "))")
+CITY_PRIORITY = {k: i for i, k in enumerate(CITY_COUNTRY_MAP)}
+
+@lru_cache(maxsize=64)  # bulk uploads often share a program; results are immutable tuples
 def extract_program_info(program_text: str) -> tuple:
     """
     Return (Program/University, City, Country)
@@ -235,154 +417,280 @@ def extract_program_info(program_text: str) -> tuple:
     # Reject obvious internal junk again
     if "rochester.edu" in program_text.lower():
         return "", "", ""
-    if re.search(r"https?://", program_text, re.I):
+    if URL_RE.search(program_text):
         return "", "", ""
 
-    program_lower = program_text.lower()
-
-    city_country_map = {
-        "milan": ("Milan", "Italy"),
-        "barcelona": ("Barcelona", "Spain"),
-        "madrid": ("Madrid", "Spain"),
-        "london": ("London", "United Kingdom"),
-        "paris": ("Paris", "France"),
-        "florence": ("Florence", "Italy"),
-        "rome": ("Rome", "Italy"),
-        "prague": ("Prague", "Czech Republic"),
-        "copenhagen": ("Copenhagen", "Denmark"),
-        "stockholm": ("Stockholm", "Sweden"),
-        "dublin": ("Dublin", "Ireland"),
-        "amsterdam": ("Amsterdam", "Netherlands"),
-        "berlin": ("Berlin", "Germany"),
-        "tokyo": ("Tokyo", "Japan"),
-        "sydney": ("Sydney", "Australia"),
-        "buenos aires": ("Buenos Aires", "Argentina"),
-        "cape town": ("Cape Town", "South Africa"),
-        "hong kong": ("Hong Kong", "China"),
-        "singapore": ("Singapore", "Singapore"),
-        "seoul": ("Seoul", "South Korea"),
-        "kyoto": ("Kyoto", "Japan"),
-        "nagoya": ("Nagoya", "Japan"),
-        "waseda": ("Tokyo", "Japan"),
-        "yonsei": ("Seoul", "South Korea"),
-        "leeds": ("Leeds", "United Kingdom"),
-        "bristol": ("Bristol", "United Kingdom"),
-        "york": ("York", "United Kingdom"),
-        "auckland": ("Auckland", "New Zealand"),
-        "cairo": ("Cairo", "Egypt"),
-        "munich": ("Munich", "Germany"),
-        "christchurch": ("Christchurch", "New Zealand"),
-        "birmingham": ("Birmingham", "United Kingdom"),
-    }
-
-    # If we see "CIEE", "IES Abroad", "Exchange", etc:
-    if "ciee" in program_lower or "ies abroad" in program_lower or "exchange" in program_lower:
-        city = ""
-        country = ""
-        for key, (cty, ctry) in city_country_map.items():
-            if key in program_lower:
-                city, country = cty, ctry
-                break
+    # "CIEE Prague", "IES Abroad Milan", "Birmingham City University" etc.
+    keys = {m.group(1) for m in CITY_RE.finditer(program_text.lower())}
+    if keys:
+        city, country = CITY_COUNTRY_MAP[min(keys, key=CITY_PRIORITY.__getitem__)]
         return program_text, city, country
 
-    # "Birmingham City University" etc.
-    for key, (cty, ctry) in city_country_map.items():
-        if key in program_lower:
-            return program_text, cty, ctry
-
     # default: keep name, blank city/country
     return program_text, "", ""
 
-def ocr_text(pdf_bytes: bytes, dpi: int = 300) -> str:
-    images = convert_from_bytes(pdf_bytes, dpi=dpi)
-    parts = []
-    for img in images:
-        parts.append(pytesseract.image_to_string(img))
+def ocr_page_list(image_paths: List[str]) -> str:
+    """
+    OCR several page images with a single tesseract instance: in-process via
+    tesserocr when available, otherwise one tesseract process that treats a
+    text file of image paths as one multi-page input. Either way language data
+    is loaded once per batch instead of once per page.
+    """
+    if PyTessBaseAPI is not None:
+        # one API (one model load) per batch; tesserocr releases the GIL while
+        # recognizing, so batches still run in parallel across the pool threads
+        parts = []
+        with PyTessBaseAPI(lang=OCR_LANG, oem=OEM.LSTM_ONLY, psm=PSM.SINGLE_BLOCK) as api:
+            for path in image_paths:
+                api.SetImageFile(path)
+                parts.append(api.GetUTF8Text())
+        # tesseract ends each page of a multi-page input with a form feed
+        return "".join(p + "\f" for p in parts)
+
+    list_path = os.path.splitext(image_paths[0])[0] + ".txt"
+    with open(list_path, "w") as f:
+        f.write("\n".join(image_paths) + "\n")
+    return pytesseract.image_to_string(list_path, lang=OCR_LANG, config=OCR_CONFIG)
+
+EASYOCR_READER = None
+EASYOCR_LOCK = threading.Lock()
+
+def easyocr_page_list(image_paths: List[str]) -> str:
+    """
+    OCR page images with EasyOCR on the GPU. EasyOCR returns one box per text
+    run, so boxes are regrouped into lines (top to bottom, then left to right)
+    to give the same line-per-row text the PATH C line scan expects.
+    """
+    global EASYOCR_READER
+    with EASYOCR_LOCK:
+        # the reader loads its models onto the GPU once, then is reused
+        if EASYOCR_READER is None:
+            EASYOCR_READER = easyocr.Reader(["en"], gpu=True)
+        pages = []
+        for path in image_paths:
+            boxes = []
+            for bbox, text, _conf in EASYOCR_READER.readtext(path):
+                ys = [pt[1] for pt in bbox]
+                boxes.append((min(ys), max(ys), min(pt[0] for pt in bbox), text))
+            boxes.sort()
+            lines = []
+            for top, bottom, x, text in boxes:
+                # same line when the box's vertical centre falls inside the line
+                if lines and (top + bottom) / 2 <= lines[-1][0]:
+                    lines[-1][1].append((x, text))
+                else:
+                    lines.append([bottom, [(x, text)]])
+            pages.append("\n".join(
+                " ".join(text for _, text in sorted(words)) for _, words in lines
+            ))
+    return "\f".join(pages)
+
+@st.cache_resource
+def ocr_pool() -> ThreadPoolExecutor:
+    """
+    One process-wide pool for tesseract batches, sized to the core count.
+    Every ocr_text call (bulk-upload files, reruns, sessions) shares it, so
+    at most one tesseract process runs per core however many PDFs are OCR'd.
+    """
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="ocr")
+
+@st.cache_data(show_spinner=False)
+def ocr_text(
+    pdf_bytes: bytes,
+    dpi: int = OCR_DPI,
+    first_page: int = None,
+    last_page: int = None
+) -> str:
+    """
+    OCR the whole PDF, or only pages first_page..last_page (1-based, inclusive).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        # PyMuPDF renders each page in-process to a greyscale pixmap that is
+        # written straight to tmp as uncompressed PGM (no Poppler subprocess,
+        # no PNG encode), so only one page is in memory at a time
+        paths = []
+        with open_pdf(pdf_bytes) as doc:
+            start = (first_page or 1) - 1
+            stop = min(last_page or doc.page_count, doc.page_count)
+            for n in range(start, stop):
+                pix = doc[n].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+                path = os.path.join(tmp, f"page-{n + 1:04d}.pgm")
+                pix.save(path)
+                paths.append(path)
+        if not paths:
+            return ""
+        if EASYOCR_GPU:
+            try:
+                return norm_space(easyocr_page_list(paths))
+            except Exception:
+                # fall back to tesseract below, but keep a GPU setup that
+                # always fails visible in the logs
+                logger.warning("EasyOCR failed, falling back to tesseract", exc_info=True)
+        # one tesseract batch per core; batches are contiguous page runs so the
+        # joined text stays in page order
+        workers = min(len(paths), os.cpu_count() or 1)
+        size = -(-len(paths) // workers)
+        batches = [paths[i:i + size] for i in range(0, len(paths), size)]
+        parts = list(ocr_pool().map(ocr_page_list, batches))
     return norm_space("\n".join(parts))
 
+def fallback_text(pdf_bytes: bytes, blocks: Dict[str, Any], dpi: int = OCR_DPI) -> Tuple[str, str]:
+    """
+    Text for the line-based fallback scan, plus where it came from.
+    Each page is checked on its own: pages whose text layer is missing or too
+    thin to be the real content are OCR'd, the rest keep their text layer.
+    OCR is skipped only when no page is thin.
+    """
+    by_page: Dict[int, List[str]] = {}
+    for page, text in zip(blocks["page"].tolist(), blocks["text"]):
+        by_page.setdefault(page, []).append(text)
+    page_text = {p: "\n".join(texts) for p, texts in by_page.items()}
+    page_count = blocks["page_count"]
+    thin = [len(page_text.get(p, "").strip()) <= PAGE_TEXT_MIN_CHARS for p in range(page_count)]
+
+    # every page carries real text (born-digital): nothing to OCR
+    if not any(thin):
+        return norm_space("\n".join(blocks["text"])), "Text layer"
+    if all(thin):
+        return ocr_text(pdf_bytes, dpi=dpi), "OCR"
+
+    # mixed scan/digital PDF: keep the text layer where it exists and OCR each
+    # run of thin pages, so the text stays in page order
+    parts = []
+    for is_thin, run in groupby(range(page_count), key=lambda p: thin[p]):
+        run = list(run)
+        if is_thin:
+            parts.append(ocr_text(pdf_bytes, dpi=dpi, first_page=run[0] + 1, last_page=run[-1] + 1))
+        else:
+            parts.extend(page_text.get(p, "") for p in run)
+    return norm_space("\n".join(parts)), "Text layer + OCR"
+
 # ---------------- PDF reading helpers ----------------
-def read_form_widgets(pdf_bytes: bytes):
+@contextmanager
+def open_pdf(pdf_bytes: bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        yield doc
+
+class Widget(NamedTuple):
+    name: str
+    value: str
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    page: int
+
+def iter_widgets(doc: fitz.Document) -> Iterator[Widget]:
+    for p in doc:
+        for w in p.widgets() or []:
+            rect = w.rect or fitz.Rect(0,0,0,0)
+            yield Widget(
+                (w.field_name or "").strip(),
+                norm_value(w.field_value or ""),
+                rect.x0, rect.y0, rect.x1, rect.y1,
+                p.number
+            )
+
+def read_form_widgets(doc: fitz.Document):
     """
-    widgets: [{name,value,x0,y0,x1,y1,page}, ...]
+    widgets: [Widget(name,value,x0,y0,x1,y1,page), ...]
     fields:  {name:value, ...}
     """
-    widgets = []
-    fields = {}
-    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-        for p in doc:
-            for w in p.widgets() or []:
-                name = (w.field_name or "").strip()
-                value = norm_space(w.field_value or "")
-                rect = w.rect or fitz.Rect(0,0,0,0)
-                item = {
-                    "name": name,
-                    "value": value,
-                    "x0": rect.x0,
-                    "y0": rect.y0,
-                    "x1": rect.x1,
-                    "y1": rect.y1,
-                    "page": p.number
-                }
-                widgets.append(item)
-                if name:
-                    fields[name] = value
+    widgets = list(iter_widgets(doc))
+    fields = {w.name: w.value for w in widgets if w.name}
     return widgets, fields
 
-def page_blocks(pdf_bytes: bytes):
+def page_blocks(doc: fitz.Document) -> Dict[str, Any]:
     """
-    Returns list of text blocks for each page with geometry.
+    Text blocks of every page, column-wise: NumPy arrays for page and
+    x0/y0/x1/y1 geometry, plus a parallel list of block texts. page_count
+    is kept too, since pages with no blocks are not otherwise visible.
     """
-    blocks = []
-    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-        for p in doc:
-            for b in p.get_text("blocks") or []:
-                x0, y0, x1, y1, text, *_ = b
-                blocks.append({
-                    "page": p.number,
-                    "x0": x0,
-                    "y0": y0,
-                    "x1": x1,
-                    "y1": y1,
-                    "text": text or ""
-                })
-    return blocks
+    pages, geom, texts = [], [], []
+    for p in doc:
+        for b in p.get_text("blocks") or []:
+            x0, y0, x1, y1, text, *_ = b
+            pages.append(p.number)
+            geom.append((x0, y0, x1, y1))
+            texts.append(text or "")
+    geom = np.array(geom, dtype=np.float64).reshape(-1, 4)
+    return {
+        "page": np.array(pages, dtype=np.int32),
+        "x0": geom[:, 0],
+        "y0": geom[:, 1],
+        "x1": geom[:, 2],
+        "y1": geom[:, 3],
+        "text": texts,
+        "page_count": doc.page_count,
+    }
 
+@st.cache_data(show_spinner=False)
+def load_pdf(pdf_bytes: bytes) -> Tuple[List[Widget], Dict[str, str], Dict[str, Any], Dict[str, bool]]:
+    """
+    Parse the PDF once and return everything the row builders need:
+    (widgets, fields, blocks, visual_signatures).
+    """
+    with open_pdf(pdf_bytes) as doc:
+        widgets, fields = read_form_widgets(doc)
+        blocks = page_blocks(doc)
+        visual_signatures = detect_visual_signatures_in_pdf(doc, widgets)
+    return widgets, fields, blocks, visual_signatures
+
+# Only used with .match() on stripped single lines, so one anchor covers every
+# branch and each tail just needs one more character rather than ".+".
 COURSE_LINE_RE = re.compile(
-    r"^\([A-Z]+\)\s+[A-Z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4}\s+.+|"
-    r"^[A-Z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4}\s+.+|"
-    r"^[A-Z]{2,4}\s+\d{2,4}[A-Z]?\s*[:\-–]\s*.+|"
-    r"^[A-Z]{2,4}\s+\d{2,4}(?:-\d{2})?\s*-\s*\d{7}-.+|"
-    r"^[A-Z]{2,8}\s+\d{2,5}\s*-\s*.+|"
-    r"^[A-Z]{2,4}\s+\d{2,4}\s*-\s*.+|"
-    r"^[A-Z]{2,10}(?:-[A-Z0-9]+)*\d+[A-Z0-9]*\s*[–-]\s*.+|"
-    r"^[A-Z]{1,4}/[A-Z]{1,4}\s+\d{2,4}\s+.+",
-    re.M
+    r"^(?:"
+    r"\([A-Z]+\)\s+[A-Z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4}\s+.|"
+    r"[A-Z]{2,4}\s+\d{2,4}\s+[A-Z]{2,4}\s+.|"
+    r"[A-Z]{2,4}\s+\d{2,4}[A-Z]?\s*[:\-–]\s*.|"
+    r"[A-Z]{2,4}\s+\d{2,4}(?:-\d{2})?\s*-\s*\d{7}-.|"
+    r"[A-Z]{2,8}\s+\d{2,5}\s*-\s*.|"
+    r"[A-Z]{2,4}\s+\d{2,4}\s*-\s*.|"
+    r"[A-Z]{2,10}(?:-[A-Z0-9]+)*\d+[A-Z0-9]*\s*[–-]\s*.|"
+    r"[A-Z]{1,4}/[A-Z]{1,4}\s+\d{2,4}\s+."
+    r")"
 )
 
-def extract_courses_by_blocks(pdf_bytes: bytes) -> List[Dict[str, Any]]:
+# Form headers that COURSE_LINE_RE would otherwise accept as course lines.
+# Each list is compiled into one anchored, case-insensitive alternation so a
+# line is screened with a single match instead of one per pattern.
+OCR_EXCLUDE_PATTERNS = [
+    r"^THE\s+COLLEGE",
+    r"^COURSE\s+APPROVAL",
+    r"^IES\s+Abroad",
+    r"^DEPARTMENT\s+OR\s+OFFICE",
+    r"^STUDENTS\s+Complete",
+    r"^AUTHORIZED\s+APPROVERS",
+    r"^HOW\s+TO\s+TRANSFER",
+    r"^FORM\s*$",
+    r"^APPROVAL\s*$",
+    r"^COLLEGE\s*$",
+    r"^COURSE\s*$"
+]
+BLOCK_EXCLUDE_PATTERNS = OCR_EXCLUDE_PATTERNS + [
+    r"^USE\s+ONLY\s*$",
+    r"^ONLY\s*$"
+]
+OCR_EXCLUDE_RE = re.compile("|".join(f"(?:{p})" for p in OCR_EXCLUDE_PATTERNS), re.I)
+BLOCK_EXCLUDE_RE = re.compile("|".join(f"(?:{p})" for p in BLOCK_EXCLUDE_PATTERNS), re.I)
+# PATH C screens each OCR line with one match: the exclude branch is tried
+# first, so a line is a course line only when lastgroup is "course"
+OCR_LINE_RE = re.compile(
+    f"(?P<exclude>(?i:{OCR_EXCLUDE_RE.pattern}))|(?P<course>{COURSE_LINE_RE.pattern})"
+)
+
+def extract_courses_by_blocks(blocks: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
-    Scan visible text blocks for lines that look like course listings.
-    Tries to join multi-line titles.
+    Scan visible text blocks (from page_blocks) for lines that look like
+    course listings. Tries to join multi-line titles.
     """
-    exclude_patterns = [
-        r"^THE\s+COLLEGE",
-        r"^COURSE\s+APPROVAL",
-        r"^IES\s+Abroad",
-        r"^DEPARTMENT\s+OR\s+OFFICE",
-        r"^STUDENTS\s+Complete",
-        r"^AUTHORIZED\s+APPROVERS",
-        r"^HOW\s+TO\s+TRANSFER",
-        r"^FORM\s*$",
-        r"^APPROVAL\s*$",
-        r"^COLLEGE\s*$",
-        r"^COURSE\s*$",
-        r"^USE\s+ONLY\s*$",
-        r"^ONLY\s*$"
-    ]
-
-    rows = []
-    for b in page_blocks(pdf_bytes):
-        txt = b["text"]
+    # (page, y in whole tenths of a point rounded half-up, text) -> first row;
+    # later duplicates of the same line are dropped as they are found
+    rows: Dict[Tuple[int, int, str], Dict[str, Any]] = {}
+    for page, x0, x1, y0, txt in zip(
+        blocks["page"].tolist(), blocks["x0"].tolist(), blocks["x1"].tolist(),
+        blocks["y0"].tolist(), blocks["text"]
+    ):
         if not txt:
             continue
         lines = txt.splitlines()
@@ -391,11 +699,7 @@ def extract_courses_by_blocks(pdf_bytes: bytes) -> List[Dict[str, Any]]:
             line_clean = lines[i].strip()
             if COURSE_LINE_RE.match(line_clean):
                 # skip if looks like header
-                skip = False
-                for patt in exclude_patterns:
-                    if re.match(patt, line_clean, re.I):
-                        skip = True
-                        break
+                skip = BLOCK_EXCLUDE_RE.match(line_clean) is not None
                 full_text = line_clean
                 if not skip:
                     # include next line if it's continuation
@@ -404,55 +708,95 @@ def extract_courses_by_blocks(pdf_bytes: bytes) -> List[Dict[str, Any]]:
                         if (
                             next_line
                             and not COURSE_LINE_RE.match(next_line)
-                            and not any(re.match(patt, next_line, re.I) for patt in exclude_patterns)
+                            and not BLOCK_EXCLUDE_RE.match(next_line)
                             and len(next_line) > 3
                         ):
                             full_text += " " + next_line
                             i += 1
-                    rows.append({
-                        "page": b["page"],
-                        "x0": b["x0"],
-                        "x1": b["x1"],
-                        "y": b["y0"],  # top Y of the block
-                        "Course": clean_course_text(full_text)
+                    course = clean_course_text(full_text)
+                    rows.setdefault((page, math.floor(y0 * 10 + 0.5), course), {
+                        "page": page,
+                        "x0": x0,
+                        "x1": x1,
+                        "y": y0,  # top Y of the block
+                        "Course": course
                     })
             i += 1
 
-    # Deduplicate by (page, y, text)
-    out = []
-    seen = set()
-    for r in sorted(rows, key=lambda x: (x["page"], round(x["y"], 1))):
-        key = (r["page"], round(r["y"], 1), r["Course"])
-        if key not in seen:
-            seen.add(key)
-            out.append(r)
-    return out
+    # ordered by (page, y tenths); sorted() is stable, so rows on the same
+    # tenth keep their block order
+    return [row for _, row in sorted(rows.items(), key=lambda kv: kv[0][:2])]
+
+def y_buckets(items: List["Widget"]) -> Dict[int, Dict[str, Any]]:
+    """
+    items grouped by page and sorted by y0 (stable, so equal y0 keep
+    document order), with their y0 values and original positions, for
+    nearest_by_y.
+    """
+    by_page: Dict[int, List["Widget"]] = {}
+    for it in items:
+        by_page.setdefault(it.page, []).append(it)
+    buckets = {}
+    for page, its in by_page.items():
+        order = sorted(range(len(its)), key=lambda k: its[k].y0)
+        buckets[page] = {
+            "y0": [its[k].y0 for k in order],
+            "items": [its[k] for k in order],
+            "pos": order,
+        }
+    return buckets
 
 def nearest_by_y(
     target_y: float,
-    items: List[Dict[str, Any]],
+    buckets: Dict[int, Dict[str, Any]],
     page: int,
     y_tol: float = 8.0
 ):
     """
-    Find item from items (which include y0/page/value)
+    Find item from buckets (built by y_buckets)
     closest in vertical position to target_y.
     """
-    best = None
-    best_d = 1e9
-    for it in items:
-        if it["page"] != page:
-            continue
-        d = abs(it["y0"] - target_y)
-        if d < best_d:
-            best_d = d
-            best = it
-    if best and best_d <= y_tol:
-        return best
+    cols = buckets.get(page)
+    if cols is None:
+        return None
+    ys = cols["y0"]
+    j = bisect_left(ys, target_y)
+    cands = []
+    if j < len(ys):
+        cands.append(j)
+    if j > 0:
+        # first of the run of equal y0 just below target_y
+        cands.append(bisect_left(ys, ys[j - 1]))
+    # closest wins; on a tie, the one earlier in the document, as before
+    i = min(cands, key=lambda k: (abs(ys[k] - target_y), cols["pos"][k]))
+    if abs(ys[i] - target_y) <= y_tol:
+        return cols["items"][i]
     return None
 
+UR_CODE_RE = re.compile(r"^[A-Z]{2,4}\s+\d{2,4}$")
+
+# substring hints for approval text near a course line; one compiled
+# alternation per category, searched against the lower-cased block text
+TEXT_ELECTIVE_RE = literal_alternation(("general elective", "elective only", "rohan", "palma", "rp"))
+TEXT_MAJOR_MINOR_RE = literal_alternation(("intr:", "major", "minor"))
+TEXT_ANY_ELECTIVE_RE = literal_alternation(("elective", "general elective", "elective only"))
+TEXT_COMMENT_RE = literal_alternation(("general elective", "elective only", "not approved", "approved"))
+
+def block_y_index(blocks: Dict[str, Any]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Per page: block y0 values sorted ascending, plus the matching positions
+    in blocks, so a y-window is two binary searches instead of a full scan.
+    """
+    index = {}
+    for page in np.unique(blocks["page"]).tolist():
+        idx = np.flatnonzero(blocks["page"] == page)
+        order = np.argsort(blocks["y0"][idx], kind="stable")
+        index[page] = (blocks["y0"][idx][order], idx[order])
+    return index
+
 def extract_approval_data_from_text_blocks(
-    pdf_bytes: bytes,
+    blocks: Dict[str, Any],
+    block_index: Dict[int, Tuple[np.ndarray, np.ndarray]],
     course_y: float,
     page: int,
     y_tolerance: float = 30.0
@@ -460,6 +804,7 @@ def extract_approval_data_from_text_blocks(
     """
     Heuristic approach for handwritten/ink signatures and UR equivalent
     that appear as plain text near the course line.
+    block_index comes from block_y_index(blocks).
     """
     approval_data = {
         "elective": "",
@@ -468,147 +813,151 @@ def extract_approval_data_from_text_blocks(
         "ur_equivalent": ""
     }
 
-    blocks = page_blocks(pdf_bytes)
-
-    nearby_blocks = [
-        b for b in blocks
-        if b["page"] == page and abs(b["y0"] - course_y) <= y_tolerance
-    ]
-
-    for block in nearby_blocks:
-        text = block["text"].strip()
+    nearby_texts = []
+    if page in block_index:
+        ys, idx = block_index[page]
+        # search a slightly wider window, then apply the exact distance test
+        lo = np.searchsorted(ys, course_y - y_tolerance - 1.0, side="left")
+        hi = np.searchsorted(ys, course_y + y_tolerance + 1.0, side="right")
+        near = idx[lo:hi][np.abs(ys[lo:hi] - course_y) <= y_tolerance]
+        nearby_texts = [blocks["text"][n] for n in np.sort(near)]
+
+    # the last matching block in document order wins each field, so walk the
+    # blocks backwards, keep the first hit per field and stop once all are set
+    for text in reversed(nearby_texts):
+        text = text.strip()
         if not text:
             continue
         lower_text = text.lower()
 
         # elective-ish
-        if any(term in lower_text for term in [
-            "general elective", "elective only", "rohan", "palma", "rp"
-        ]):
+        if not approval_data["elective"] and TEXT_ELECTIVE_RE.search(lower_text):
             approval_data["elective"] = text
 
         # major/minor-ish
         if (
-            any(term in lower_text for term in ["intr:", "major", "minor"])
-            and not any(term in lower_text for term in ["elective", "general elective", "elective only"])
+            not approval_data["major_minor"]
+            and TEXT_MAJOR_MINOR_RE.search(lower_text)
+            and not TEXT_ANY_ELECTIVE_RE.search(lower_text)
         ):
             approval_data["major_minor"] = text
 
         # Detect UR equivalent pattern like "FIN 224" / "N/A"
-        if (
-            re.match(r"^[A-Z]{2,4}\s+\d{2,4}$", text.strip())
-            or text.strip().upper() == "N/A"
+        if not approval_data["ur_equivalent"] and (
+            UR_CODE_RE.match(text)
+            or text.upper() == "N/A"
         ):
-            approval_data["ur_equivalent"] = text.strip()
+            approval_data["ur_equivalent"] = text
 
         # comments
-        if any(term in lower_text for term in [
-            "general elective", "elective only", "not approved", "approved"
-        ]):
+        if not approval_data["comments"] and TEXT_COMMENT_RE.search(lower_text):
             approval_data["comments"] = text
 
+        if all(approval_data.values()):
+            break
+
     return approval_data
 
-def infer_header_from_fields(fields: Dict[str, str], pdf_bytes: bytes = None) -> Dict[str, str]:
-    fd = {(k or "").strip().lower(): norm_space(v) for k, v in (fields or {}).items()}
+# header value -> (key substrings, key substrings to avoid, value pattern);
+# the first usable field whose lower-cased key matches a rule fills that value
+HEADER_KEY_RULES = {
+    "Name": (("name",), ("course", "comments", "equiv", "approve"), None),
+    "StudentID": (("student", "id"), (), STUDENT_ID_RE),
+    "ClassYear": (("class",), (), CLASS_YEAR_RE),
+    "Date": (("date",), (), DATE_RE),
+    "Program": (
+        ("study abroad", "host university", "host institution", "program", "college where"),
+        ("course", "comments", "equiv", "approve", "class", "semester", "id", "date", "name"),
+        None
+    ),
+    "Semester": (("semester", "term"), (), TERM_RE),
+}
+
+def infer_header_from_fields(fields: Dict[str, str], blocks: Dict[str, Any] = None) -> Dict[str, str]:
+    fd = {(k or "").strip().lower(): norm_value(v) for k, v in (fields or {}).items()}
 
     def looks_like_url(v: str) -> bool:
-        return bool(re.search(r"https?://", v, re.I))
+        return bool(URL_RE.search(v))
 
-    def pick_by_key(keys, avoid=None, value_re=None):
-        avoid = avoid or []
-        for k, v in fd.items():
-            if not v:
-                continue
-            # skip obvious junk like URLs or Rochester boilerplate
-            if looks_like_url(v):
-                continue
-            if "rochester.edu" in v.lower():
-                continue
+    # non-empty fields minus obvious junk like URLs or Rochester boilerplate;
+    # screened once here rather than on every key-rule / fallback pass
+    usable = {
+        k: v for k, v in fd.items()
+        if v and not looks_like_url(v) and "rochester.edu" not in v.lower()
+    }
 
-            if any(key in k for key in keys) and not any(bad in k for bad in avoid):
-                if value_re and not re.search(value_re, v, re.I):
-                    continue
-                return v
-        return ""
+    # one pass over the fields fills every HEADER_KEY_RULES value
+    picked = dict.fromkeys(HEADER_KEY_RULES, "")
+    for k, v in usable.items():
+        for label, (keys, avoid, value_re) in HEADER_KEY_RULES.items():
+            if picked[label]:
+                continue
+            if (
+                any(key in k for key in keys)
+                and not any(bad in k for bad in avoid)
+                and (value_re is None or value_re.search(v))
+            ):
+                picked[label] = v
 
     # Name
-    name = pick_by_key(["name"], avoid=["course", "comments", "equiv", "approve"])
+    name = picked["Name"]
     if not name:
         for v in fd.values():
             if not v:
                 continue
             if looks_like_url(v):
                 continue
-            if re.match(r"^[A-Za-z][A-Za-z .'-]+ [A-Za-z][A-Za-z .'-]+$", v):
+            if PERSON_NAME_RE.match(v):
                 name = v
                 break
 
     # Student ID
-    student_id = pick_by_key(["student", "id"], value_re=r"^\d{5,10}$")
+    student_id = picked["StudentID"]
     if not student_id:
         for v in fd.values():
-            if not v:
-                continue
-            if re.fullmatch(r"\d{5,10}", v or ""):
+            # same test as STUDENT_ID_RE (\d is str.isdecimal), without the regex
+            if 5 <= len(v) <= 10 and v.isdecimal():
                 student_id = v
                 break
 
     # Class year
-    class_year = pick_by_key(["class"], value_re=r"^\d{4}$")
+    class_year = picked["ClassYear"]
     if not class_year:
         for v in fd.values():
-            if not v:
+            if not v or len(v) > 6:
                 continue
-            m = YEAR_RE.search(v or "")
-            if m and len(v) <= 6:
+            m = YEAR_RE.search(v)
+            if m:
                 class_year = m.group(0)
                 break
 
     # Date
-    date_val = pick_by_key(["date"], value_re=DATE_RE.pattern)
+    date_val = picked["Date"]
     if not date_val:
         for v in fd.values():
-            if not v:
+            # DATE_RE needs a / or - separator; skip the regex for anything else
+            if "/" not in v and "-" not in v:
                 continue
-            m = DATE_RE.search(v or "")
+            m = DATE_RE.search(v)
             if m:
                 date_val = m.group(0)
                 break
 
     # --- Program / Host University inference ---
     # Step 1: look for explicit keys like "program", "study abroad program", etc.
-    program = pick_by_key(
-        ["study abroad", "host university", "host institution", "program", "college where"],
-        avoid=["course", "comments", "equiv", "approve", "class", "semester", "id", "date", "name"]
-    )
+    program = picked["Program"]
 
     # Step 2: fallback heuristic from fields
     if not program:
         candidates = []
-        for k, v in fd.items():
-            if not v:
-                continue
-            if looks_like_url(v):
-                continue
-            if "rochester.edu" in v.lower():
-                continue
-
+        for k, v in usable.items():
             # skip things that are clearly not a provider/university
-            if any(bad in k for bad in [
-                "course", "comment", "equiv", "approve", "majorminor",
-                "class", "semester", "id", "date", "name", "signature",
-                "advisor", "chair", "dean"
-            ]):
+            if PROGRAM_KEY_AVOID_RE.search(k):
                 continue
 
             # keep things likely to be a host program
             # hints: University, College, Institute, CIEE, IES Abroad, Exchange, Business School
-            if re.search(
-                r"(university|college|institute|institut|academy|exchange|ciee|ies abroad|study abroad|business school)",
-                v,
-                re.I
-            ):
+            if PROGRAM_HINT_RE.search(v):
                 candidates.append(v)
 
         if candidates:
@@ -616,34 +965,31 @@ def infer_header_from_fields(fields: Dict[str, str], pdf_bytes: bytes = None) ->
             program = max(candidates, key=len)
 
     # Step 3: last resort, scan visible text blocks for likely program text
-    if not program and pdf_bytes:
-        try:
-            for block in page_blocks(pdf_bytes):
-                text = block["text"].strip()
-                if not text:
-                    continue
-                if looks_like_url(text):
-                    continue
-                if "rochester.edu" in text.lower():
-                    continue
-
-                # must mention something that sounds like a host site, not instructions
-                if (
-                    re.search(r"(university|college|institute|ciee|ies abroad|exchange|business school)", text, re.I)
-                    and not re.search(r"(course|subject|number|title|instructions|advisor|signature)", text, re.I)
-                    and len(text) > 15
-                ):
-                    program = text
-                    break
-        except Exception:
-            pass
+    if not program and blocks:
+        for text in blocks["text"]:
+            text = text.strip()
+            if not text:
+                continue
+            if looks_like_url(text):
+                continue
+            if "rochester.edu" in text.lower():
+                continue
+
+            # must mention something that sounds like a host site, not instructions
+            if (
+                BLOCK_PROGRAM_HINT_RE.search(text)
+                and not BLOCK_PROGRAM_AVOID_RE.search(text)
+                and len(text) > 15
+            ):
+                program = text
+                break
 
     # Final cleanup: if we STILL don't trust it, blank it out
     if program and ("rochester.edu" in program.lower() or looks_like_url(program)):
         program = ""
 
     # Semester / Term
-    semester = pick_by_key(["semester", "term"], value_re=TERM_RE.pattern)
+    semester = picked["Semester"]
     if not semester:
         for v in fd.values():
             if not v:
@@ -662,98 +1008,185 @@ def infer_header_from_fields(fields: Dict[str, str], pdf_bytes: bytes = None) ->
     }
 
 # ---------------- Signature detection helpers ----------------
-def detect_visual_signatures_in_pdf(pdf_bytes: bytes, widgets: List[Dict]) -> Dict[str, bool]:
+def box_array(rects: List[Any]) -> np.ndarray:
+    """
+    (N, 4) float array of x0, y0, x1, y1 for the rects that fitz.Rect.intersects
+    can match at all (empty and infinite rects never intersect anything).
+    """
+    boxes = [
+        (r.x0, r.y0, r.x1, r.y1)
+        for r in map(fitz.Rect, rects)
+        if not r.is_empty and not r.is_infinite
+    ]
+    return np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+def boxes_intersect_any(boxes: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    For each target box, whether any of boxes overlaps it with positive area
+    (the same strict test as fitz.Rect.intersects). Inputs come from box_array.
+    """
+    if not len(boxes) or not len(targets):
+        return np.zeros(len(targets), dtype=bool)
+    b, t = boxes[:, None, :], targets[None, :, :]
+    return (
+        (t[..., 0] < b[..., 2]) & (b[..., 0] < t[..., 2])
+        & (t[..., 1] < b[..., 3]) & (b[..., 1] < t[..., 3])
+    ).any(axis=0)
+
+def points_inside_any(points: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    For each target box (x0, y0, x1, y1), whether any (x, y) point lies
+    inside it, edges included.
+    """
+    if not len(points) or not len(targets):
+        return np.zeros(len(targets), dtype=bool)
+    x, y = points[:, None, 0], points[:, None, 1]
+    return (
+        (targets[None, :, 0] <= x) & (x <= targets[None, :, 2])
+        & (targets[None, :, 1] <= y) & (y <= targets[None, :, 3])
+    ).any(axis=0)
+
+def detect_visual_signatures_in_pdf(doc: fitz.Document, widgets: List[Widget]) -> Dict[str, bool]:
     """
     Attempt to detect ink-like marks / annotations in approval boxes.
     Returns map: {widget_name: bool}
     """
     signature_map = {}
     try:
-        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                drawings = page.get_drawings()
-                annotations = list(page.annots()) if page.annots() else []
-
-                for widget in widgets:
-                    widget_name_full = widget.get("name", "")
-                    widget_name = (widget_name_full or "").lower()
-                    if widget["page"] != page_num:
-                        continue
-                    if not (
-                        "elec" in widget_name or
-                        "major" in widget_name or
-                        "minor" in widget_name
-                    ):
-                        continue
-
-                    rect = fitz.Rect(
-                        widget["x0"] - 3, widget["y0"] - 3,
-                        widget["x1"] + 3, widget["y1"] + 3
+        # pages without approval boxes need no drawing/word extraction at all
+        for page_num, page_widgets in approval_widgets_by_page(widgets).items():
+            page = doc[page_num]
+
+            # drawing geometry and annotations as box/point arrays, tested
+            # against all of the page's approval boxes at once
+            rects = [
+                fitz.Rect(w.x0 - 3, w.y0 - 3, w.x1 + 3, w.y1 + 3) for w in page_widgets
+            ]
+            targets = np.array([(r.x0, r.y0, r.x1, r.y1) for r in rects], dtype=np.float64).reshape(-1, 4)
+
+            # a drawing's "rect" bounds all of its items, so only drawings whose
+            # rect touches some approval box (edges included, since a straight
+            # line has a zero-height rect) need their items looked at
+            drawings = page.get_drawings()
+            draw_boxes = np.array(
+                [tuple(d["rect"]) for d in drawings], dtype=np.float64
+            ).reshape(-1, 4)
+            touching = (
+                (draw_boxes[:, None, 0] <= targets[None, :, 2])
+                & (targets[None, :, 0] <= draw_boxes[:, None, 2])
+                & (draw_boxes[:, None, 1] <= targets[None, :, 3])
+                & (targets[None, :, 1] <= draw_boxes[:, None, 3])
+            ).any(axis=1)
+            shape_rects = []
+            shape_points = []
+            for n in np.flatnonzero(touching):
+                for item in drawings[n].get("items", []):
+                    # item[0] indicates shape type; item[1] may be geometry
+                    if item[0] in [1, 2, 3] and len(item) >= 2:  # line/rect/curve
+                        geom = item[1]
+                        if hasattr(geom, "x0"):
+                            shape_rects.append(geom)
+                        elif isinstance(geom, (list, tuple)) and len(geom) >= 2:
+                            shape_points.append((geom[0], geom[1]))
+            # an empty/infinite widget box intersects nothing (points still count)
+            valid = np.array([not r.is_empty and not r.is_infinite for r in rects], dtype=bool)
+            has_shape = (
+                boxes_intersect_any(box_array(shape_rects), targets) & valid
+            ) | points_inside_any(np.array(shape_points, dtype=np.float64).reshape(-1, 2), targets)
+            has_annot = boxes_intersect_any(
+                box_array([a.rect for a in (page.annots() or [])]), targets
+            ) & valid
+            # one word extraction per page; a widget only needs the clipped
+            # get_text when the words touching it hold 2+ characters
+            words = page.get_text("words")
+            word_boxes = np.array([w[:4] for w in words], dtype=np.float64).reshape(-1, 4)
+            word_lens = np.array([len(w[4]) for w in words], dtype=np.int64)
+
+            for widget, rect, shape_hit, annot_hit in zip(page_widgets, rects, has_shape, has_annot):
+                widget_name_full = widget.name
+
+                # check drawings, then annotations
+                has_sig = bool(shape_hit or annot_hit)
+
+                # check text in that area
+                if not has_sig:
+                    touching = (
+                        (word_boxes[:, 0] <= rect.x1) & (word_boxes[:, 2] >= rect.x0)
+                        & (word_boxes[:, 1] <= rect.y1) & (word_boxes[:, 3] >= rect.y0)
                     )
-
-                    has_sig = False
-
-                    # check drawings
-                    for d in drawings:
-                        for item in d.get("items", []):
-                            # item[0] indicates shape type; item[1] may be geometry
-                            if item[0] in [1, 2, 3]:  # line/rect/curve
-                                if len(item) >= 2:
-                                    geom = item[1]
-                                    # rect intersection
-                                    if hasattr(geom, "x0"):
-                                        if rect.intersects(geom):
-                                            has_sig = True
-                                            break
-                                    elif isinstance(geom, (list, tuple)) and len(geom) >= 2:
-                                        x, y = geom[0], geom[1]
-                                        if rect.x0 <= x <= rect.x1 and rect.y0 <= y <= rect.y1:
-                                            has_sig = True
-                                            break
-                        if has_sig:
-                            break
-
-                    # check annotations
-                    if not has_sig:
-                        for annot in annotations:
-                            if annot.rect.intersects(rect):
-                                has_sig = True
-                                break
-
-                    # check text in that area
-                    if not has_sig:
+                    if word_lens[touching].sum() > 1:
                         txt_clip = page.get_text("text", clip=rect)
                         if txt_clip.strip() and len(txt_clip.strip()) > 1:
                             has_sig = True
 
-                    signature_map[widget_name_full] = has_sig
+                signature_map[widget_name_full] = has_sig
 
         return signature_map
 
     except Exception:
         # Fallback: all False
         for w in widgets:
-            signature_map[w.get("name","")] = False
+            signature_map[w.name] = False
         return signature_map
 
 # ---------------- Core row assembly ----------------
+# output columns of PATH A / PATH B rows (row tuples are built in this order)
+ROW_COLUMNS = [
+    "Program/University", "City", "Country",
+    "Course Code", "Course Title", "UR Equivalent", "Major/Minor or Elective",
+    "UR Credits", "Foreign Credits", "Course Page Link", "Syllabus Link",
+    "CourseIndex", "Original_Course", "Elective_Approval", "MajorMinor_Approval", "Comments",
+]
+ROW_DEBUG_COLUMNS = ["Debug_Signature_Detected", "Debug_Course_Y"]
+
+FORM_SLOT_RE = re.compile(
+    r"(Course|course|Equivalent|equivalent|ElecApprove|elecapprove"
+    r"|MajorMinorApproval|majorminorapproval|Comments|comments)(0|[1-9][0-9]*)"
+)
+
+def form_rows_by_index(fields: Dict[str, str]) -> Dict[int, Dict[str, str]]:
+    """
+    Values of the numbered CAF fields (Course1, Equivalent1, ...) grouped
+    by row index: {1: {"course": ..., "equivalent": ..., ...}, ...}.
+    The capitalised name wins over the lower-case one unless it is empty.
+    """
+    rows: Dict[int, Dict[str, str]] = {}
+    for name, value in fields.items():
+        m = FORM_SLOT_RE.fullmatch(name)
+        if not m:
+            continue
+        row = rows.setdefault(int(m.group(2)), {})
+        col = m.group(1).lower()
+        if m.group(1)[0].isupper():
+            if value or col not in row:
+                row[col] = value
+        elif not row.get(col):
+            row[col] = value
+    return rows
+
+def ocr_course_lines(text: str) -> List[str]:
+    """
+    Lines of the fallback text that look like course listings (PATH C).
+    """
+    lines = []
+    for l in text.splitlines():
+        m = OCR_LINE_RE.match(l.strip())
+        if m and m.lastgroup == "course":
+            lines.append(l)
+    return lines
+
+@st.cache_data(show_spinner=False, max_entries=64)
 def build_rows(pdf_bytes: bytes) -> Tuple[pd.DataFrame, str, Dict[str,str]]:
-    widgets, fields = read_form_widgets(pdf_bytes)
-    header = infer_header_from_fields(fields, pdf_bytes)
+    widgets, fields, blocks, visual_signatures = load_pdf(pdf_bytes)
+    header = infer_header_from_fields(fields, blocks)
 
     # small helper to gather widget values by suffix index
-    def pick_widgets_containing(substring: str) -> List[Dict[str, Any]]:
+    def pick_widgets_containing(substring: str) -> List[Widget]:
         out = []
         for w in widgets:
-            if substring.lower() in (w["name"] or "").lower():
-                if w["value"]:
-                    out.append({
-                        "page": w["page"],
-                        "y0": w["y0"],
-                        "x0": w["x0"],
-                        "value": w["value"]
-                    })
+            if substring.lower() in w.name.lower():
+                if w.value:
+                    out.append(w)
         return out
 
     w_elec   = pick_widgets_containing("elecapprove")
@@ -763,27 +1196,17 @@ def build_rows(pdf_bytes: bytes) -> Tuple[pd.DataFrame, str, Dict[str,str]]:
     w_courses_form = pick_widgets_containing("course")  # not directly used but keeps structure
 
     # ---------- PATH A: structured "Course1 / Equivalent1 / ..." fields ----------
-    rows_path_a: List[Dict[str, Any]] = []
-    indices = set()
-
-    for w in widgets:
-        m = re.search(
-            r"(course|equivalent|elecapprove|majorminorapproval|comments)\s*([0-9]+)$",
-            (w["name"] or ""),
-            re.I
-        )
-        if m:
-            indices.add(int(m.group(2)))
+    rows_path_a: List[Tuple] = []
 
-    # detect visual signatures once at top
-    visual_signatures = detect_visual_signatures_in_pdf(pdf_bytes, widgets)
+    # the header is fixed for the whole form, so parse the program once for all paths
+    program_name, city, country = extract_program_info(header.get("Program", ""))
 
-    for i in sorted(indices):
-        raw_course = norm_space(fields.get(f"Course{i}", "") or fields.get(f"course{i}", ""))
-        raw_equiv = norm_space(fields.get(f"Equivalent{i}", "") or fields.get(f"equivalent{i}", ""))
-        raw_elec = norm_space(fields.get(f"ElecApprove{i}", "") or fields.get(f"elecapprove{i}", ""))
-        raw_mm = norm_space(fields.get(f"MajorMinorApproval{i}", "") or fields.get(f"majorminorapproval{i}", ""))
-        raw_comments = norm_space(fields.get(f"Comments{i}", "") or fields.get(f"comments{i}", ""))
+    for i, row in sorted(form_rows_by_index(fields).items()):
+        raw_course = norm_value(row.get("course", ""))
+        raw_equiv = norm_value(row.get("equivalent", ""))
+        raw_elec = norm_value(row.get("elecapprove", ""))
+        raw_mm = norm_value(row.get("majorminorapproval", ""))
+        raw_comments = norm_value(row.get("comments", ""))
 
         # If literally everything is empty, skip
         if not any([raw_course, raw_equiv, raw_elec, raw_mm, raw_comments]):
@@ -792,8 +1215,6 @@ def build_rows(pdf_bytes: bytes) -> Tuple[pd.DataFrame, str, Dict[str,str]]:
         course_code, course_title = parse_course_code_and_title(raw_course)
         ur_equivalent = raw_equiv  # <-- define so it's always available
 
-        program_name, city, country = extract_program_info(header.get("Program", ""))
-
         # infer signature presence for this index:
         signature_detected = {"elective": False, "major_minor": False}
         elec_widget_name = f"ElecApprove{i}"
@@ -811,50 +1232,48 @@ def build_rows(pdf_bytes: bytes) -> Tuple[pd.DataFrame, str, Dict[str,str]]:
             raw_comments
         )
 
-        rows_path_a.append({
-            "Program/University": program_name,
-            "City": city,
-            "Country": country,
-            "Course Code": course_code,
-            "Course Title": course_title,
-            "UR Equivalent": ur_equivalent,
-            "Major/Minor or Elective": approval_type,
-            "UR Credits": "",          # not captured here yet
-            "Foreign Credits": "",     # not captured here yet
-            "Course Page Link": "",    # not captured here yet
-            "Syllabus Link": "",       # not captured here yet
-            "CourseIndex": i,
-            "Original_Course": raw_course,
-            "Elective_Approval": raw_elec,
-            "MajorMinor_Approval": raw_mm,
-            "Comments": raw_comments
-        })
+        rows_path_a.append((
+            program_name, city, country,
+            course_code, course_title, ur_equivalent, approval_type,
+            "", "", "", "",            # credits / links: not captured here yet
+            i, raw_course, raw_elec, raw_mm, raw_comments
+        ))
 
     if rows_path_a:
-        df_a = pd.DataFrame(rows_path_a).sort_values("CourseIndex")
+        # row indices were walked in sorted order, so rows are already by CourseIndex
+        df_a = pd.DataFrame.from_records(rows_path_a, columns=ROW_COLUMNS)
         return df_a, "Form fields", header
 
     # ---------- PATH B: scrape visible text blocks and align by y ----------
-    courses_text = extract_courses_by_blocks(pdf_bytes)
-    assembled_b: List[Dict[str, Any]] = []
+    courses_text = extract_courses_by_blocks(blocks)
+    widget_cols = widget_columns(widgets)
+    cols_eq = y_buckets(w_equiv)
+    cols_el = y_buckets(w_elec)
+    cols_mm = y_buckets(w_mm)
+    cols_cm = y_buckets(w_comm)
+    block_index = block_y_index(blocks)
+    assembled_b: List[Tuple] = []
 
     for idx, c in enumerate(courses_text, start=1):
+        # a blank course line would be dropped from the output anyway
+        if not c["Course"].strip():
+            continue
+
         # for each detected course line, find nearest data widgets
-        near_eq  = nearest_by_y(c["y"], w_equiv, c["page"])
-        near_el  = nearest_by_y(c["y"], w_elec,  c["page"])
-        near_mm  = nearest_by_y(c["y"], w_mm,    c["page"])
-        near_cm  = nearest_by_y(c["y"], w_comm,  c["page"])
+        near_eq  = nearest_by_y(c["y"], cols_eq, c["page"])
+        near_el  = nearest_by_y(c["y"], cols_el, c["page"])
+        near_mm  = nearest_by_y(c["y"], cols_mm, c["page"])
+        near_cm  = nearest_by_y(c["y"], cols_cm, c["page"])
 
         # parse course info
         course_code, course_title = parse_course_code_and_title(c["Course"])
-        program_name, city, country = extract_program_info(header.get("Program", ""))
 
         # try to extract approval info from local block text (handwriting case)
-        text_approval_data = extract_approval_data_from_text_blocks(pdf_bytes, c["y"], c["page"])
+        text_approval_data = extract_approval_data_from_text_blocks(blocks, block_index, c["y"], c["page"])
 
         # signature detection near row using widgets
         sig_detect_local = detect_signature_in_widgets(
-            widgets,
+            widget_cols,
             c["y"],
             c["page"]
         )
@@ -866,12 +1285,12 @@ def build_rows(pdf_bytes: bytes) -> Tuple[pd.DataFrame, str, Dict[str,str]]:
             sig_detect_local["major_minor"] = True
 
         # pick final approval fields
-        elective_approval = (near_el or {}).get("value", "") or text_approval_data.get("elective", "")
-        major_minor_approval = (near_mm or {}).get("value", "") or text_approval_data.get("major_minor", "")
-        comments = (near_cm or {}).get("value", "") or text_approval_data.get("comments", "")
+        elective_approval = getattr(near_el, "value", "") or text_approval_data.get("elective", "")
+        major_minor_approval = getattr(near_mm, "value", "") or text_approval_data.get("major_minor", "")
+        comments = getattr(near_cm, "value", "") or text_approval_data.get("comments", "")
 
         ur_equivalent = (
-            (near_eq or {}).get("value", "") or
+            getattr(near_eq, "value", "") or
             text_approval_data.get("ur_equivalent", "")
         )
 
@@ -882,92 +1301,114 @@ def build_rows(pdf_bytes: bytes) -> Tuple[pd.DataFrame, str, Dict[str,str]]:
             comments
         )
 
-        assembled_b.append({
-            "Program/University": program_name,
-            "City": city,
-            "Country": country,
-            "Course Code": course_code,
-            "Course Title": course_title,
-            "UR Equivalent": ur_equivalent,
-            "Major/Minor or Elective": approval_type,
-            "UR Credits": "",
-            "Foreign Credits": "",
-            "Course Page Link": "",
-            "Syllabus Link": "",
-            "CourseIndex": idx,
-            "Original_Course": c["Course"],
-            "Elective_Approval": elective_approval,
-            "MajorMinor_Approval": major_minor_approval,
-            "Comments": comments,
-            "Debug_Signature_Detected": str(sig_detect_local),
-            "Debug_Course_Y": c["y"],
-        })
+        row = (
+            program_name, city, country,
+            course_code, course_title, ur_equivalent, approval_type,
+            "", "", "", "",
+            idx, c["Course"], elective_approval, major_minor_approval, comments
+        )
+        if DEBUG:
+            row += (str(sig_detect_local), c["y"])
+        assembled_b.append(row)
 
-    if assembled_b:
-        df_b = pd.DataFrame(assembled_b)
-        df_b = df_b[df_b["Original_Course"].str.strip().ne("")]
+    if courses_text:
+        columns_b = ROW_COLUMNS + ROW_DEBUG_COLUMNS if DEBUG else ROW_COLUMNS
+        df_b = pd.DataFrame.from_records(assembled_b, columns=columns_b)
         return df_b, "Text blocks (y-aligned)", header
 
-    # ---------- PATH C: OCR fallback ----------
-    ocr_txt = ocr_text(pdf_bytes, dpi=300)
-    lines = []
-    exclude_patterns = [
-        r"^THE\s+COLLEGE",
-        r"^COURSE\s+APPROVAL",
-        r"^IES\s+Abroad",
-        r"^DEPARTMENT\s+OR\s+OFFICE",
-        r"^STUDENTS\s+Complete",
-        r"^AUTHORIZED\s+APPROVERS",
-        r"^HOW\s+TO\s+TRANSFER",
-        r"^FORM\s*$",
-        r"^APPROVAL\s*$",
-        r"^COLLEGE\s*$",
-        r"^COURSE\s*$"
-    ]
-    for l in ocr_txt.splitlines():
-        line_clean = l.strip()
-        if COURSE_LINE_RE.match(line_clean):
-            skip = False
-            for patt in exclude_patterns:
-                if re.match(patt, line_clean, re.I):
-                    skip = True
-                    break
-            if not skip:
-                lines.append(l)
+    # ---------- PATH C: OCR fallback (text layer for born-digital PDFs) ----------
+    ocr_txt, text_source = fallback_text(pdf_bytes, blocks)
+    # a pure text layer is what PATH B just scanned without finding courses
+    lines = [] if text_source == "Text layer" else ocr_course_lines(ocr_txt)
+    if not lines:
+        # nothing course-like in the text layer or the OCR_DPI pass (broken
+        # text layers, small or faint print): OCR every page once at the
+        # higher resolution, as the original fallback did. A scan with no
+        # course lines at all therefore pays for both OCR passes.
+        ocr_txt, text_source = ocr_text(pdf_bytes, dpi=OCR_RETRY_DPI), "OCR"
+        lines = ocr_course_lines(ocr_txt)
 
     if lines:
-        assembled_c = []
+        assembled_c: List[Tuple] = []
         for i, l in enumerate(lines, start=1):
             course_text = clean_course_text(l)
             code_c, title_c = parse_course_code_and_title(course_text)
-            program_name, city, country = extract_program_info(header.get("Program", ""))
-
-            assembled_c.append({
-                "Program/University": program_name,
-                "City": city,
-                "Country": country,
-                "Course Code": code_c,
-                "Course Title": title_c,
-                "UR Equivalent": "",
-                "Major/Minor or Elective": "",
-                "UR Credits": "",
-                "Foreign Credits": "",
-                "Course Page Link": "",
-                "Syllabus Link": "",
-                "CourseIndex": i,
-                "Original_Course": course_text,
-                "Elective_Approval": "",
-                "MajorMinor_Approval": "",
-                "Comments": ""
-            })
 
-        df_c = pd.DataFrame(assembled_c)
-        return df_c, "OCR (courses only)", header
+            assembled_c.append((
+                program_name, city, country,
+                code_c, title_c, "", "",
+                "", "", "", "",
+                i, course_text, "", "", ""
+            ))
+
+        df_c = pd.DataFrame.from_records(assembled_c, columns=ROW_COLUMNS)
+        return df_c, f"{text_source} (courses only)", header
 
     # If literally nothing worked:
     return pd.DataFrame(), "None", header
 
+@st.cache_data(show_spinner=False, max_entries=64)
+def debug_tables(pdf_bytes: bytes) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Tables for the signature debug expander: all widgets, approval widgets
+    with a text-based signature guess, and visual signature results.
+    """
+    widgets, _, _, vis_map = load_pdf(pdf_bytes)
+
+    all_widgets = []
+    for w in widgets:
+        all_widgets.append({
+            "Widget Name": w.name,
+            "Value": w.value,
+            "Page": w.page,
+            "Y Position": round(w.y0, 1)
+        })
+
+    sig_rows = []
+    for w in widgets:
+        widget_name = w.name.lower()
+        widget_value = w.value.strip()
+        kind = approval_kind(widget_name)
+        if kind:
+            # if looks like real initials/name (not generic yes/no)
+            has_signature = (
+                widget_value
+                and widget_value.lower() not in NON_SIG_VALUES
+                and len(widget_value.strip()) > 1
+            )
+            sig_rows.append({
+                "Widget Name": w.name,
+                "Value": widget_value,
+                "Page": w.page,
+                "Y Position": round(w.y0, 1),
+                "Type": "Elective" if kind == "elective" else "Major/Minor",
+                "Has Signature (text)": has_signature
+            })
+
+    vis_rows = []
+    for widget_name, has_sig in vis_map.items():
+        low = widget_name.lower() if widget_name else ""
+        if approval_kind(low):
+            vis_rows.append({
+                "Widget Name": widget_name,
+                "Has Visual Signature": has_sig
+            })
+
+    return pd.DataFrame(all_widgets), pd.DataFrame(sig_rows), pd.DataFrame(vis_rows)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def debug_field_keys(pdf_bytes: bytes) -> List[str]:
+    """
+    A sample of the raw form field keys, for the header debug expander.
+    """
+    _, fields, _, _ = load_pdf(pdf_bytes)
+    return list(fields.keys())[:50]
+
 # ---------------- Streamlit UI ----------------
+# st.dataframe sends every row to the browser on each rerun; larger results
+# show this many rows by default (the CSV download always has all of them)
+DISPLAY_ROWS = 500
+
 st.sidebar.header("Upload Options")
 upload_mode = st.sidebar.radio("Choose upload mode:", ["Single File", "Bulk Upload"])
 
@@ -989,13 +1430,25 @@ else:
 all_results = []
 all_headers = []
 
-for pdf_file, file_name in zip(pdf_files, file_names):
-    st.write(f"Processing {file_name}...")
-    pdf_bytes = pdf_file.read()
+# UploadedFile is a BytesIO over the uploaded bytes; getvalue() hands back that
+# same bytes object (no copy, whatever the read position), which is what the
+# st.cache_data helpers hash and fitz reads
+pdf_blobs = [f.getvalue() for f in pdf_files]
+
+# PyMuPDF and tesseract release the GIL, so bulk uploads parse in parallel.
+# Workers get the script context so st.cache_data behaves as in the main
+# thread; all st.* output stays below, in upload order.
+script_ctx = get_script_run_ctx()
 
-    with st.spinner(f"Parsing {file_name}..."):
-        df, path, header = build_rows(pdf_bytes)
+def attach_script_ctx():
+    add_script_run_ctx(threading.current_thread(), script_ctx)
 
+with st.spinner(f"Parsing {len(pdf_blobs)} file(s)..."):
+    workers = min(8, len(pdf_blobs), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, initializer=attach_script_ctx) as pool:
+        parsed = list(pool.map(build_rows, pdf_blobs))
+
+for file_name, pdf_bytes, (df, path, header) in zip(file_names, pdf_blobs, parsed):
     if not df.empty:
         df["Source File"] = file_name
         all_results.append(df)
@@ -1031,94 +1484,59 @@ else:
         "Syllabus Link"
     ]
 
-    # Ensure all columns exist
-    for col in desired_cols:
-        if col not in combined_df.columns:
-            combined_df[col] = ""
-
-    final_df = combined_df[desired_cols].copy()
+    # Ensure all columns exist (missing ones filled with "") in one pass
+    final_df = combined_df.reindex(columns=desired_cols, fill_value="")
 
-    st.dataframe(final_df, use_container_width=True)
+    rows_shown = len(final_df)
+    if rows_shown > DISPLAY_ROWS:
+        rows_shown = int(st.number_input(
+            "Rows to show", min_value=100, max_value=rows_shown, value=DISPLAY_ROWS, step=100
+        ))
+        st.caption(f"Showing {rows_shown} of {len(final_df)} rows; the CSV download includes all of them.")
+    st.dataframe(final_df.head(rows_shown), use_container_width=True)
 
-    csv_data = final_df.to_csv(index=False)
+    # write the CSV straight to bytes rather than building a str and encoding it
+    csv_buf = BytesIO()
+    final_df.to_csv(csv_buf, index=False, encoding="utf-8")
     st.download_button(
         "Download Combined Results as CSV",
-        csv_data.encode("utf-8"),
+        csv_buf.getvalue(),
         file_name="caf_bulk_results.csv",
         mime="text/csv"
     )
 
     # Debug info
     with st.expander("Debug: Original Data"):
-        st.dataframe(combined_df, use_container_width=True)
-
-    with st.expander("Debug: Signature Detection Details"):
-        widgets, fields = read_form_widgets(pdf_bytes)
-
-        st.write("**All Widgets Found:**")
-        all_widgets = []
-        for w in widgets:
-            all_widgets.append({
-                "Widget Name": w["name"],
-                "Value": w["value"],
-                "Page": w["page"],
-                "Y Position": round(w["y0"], 1)
-            })
-        if all_widgets:
-            st.dataframe(pd.DataFrame(all_widgets), use_container_width=True)
-        else:
-            st.write("No widgets found at all.")
-
-        st.write("**Approval Widgets (text-based signature guess):**")
-        sig_rows = []
-        for w in widgets:
-            widget_name = (w["name"] or "").lower()
-            widget_value = (w["value"] or "").strip()
-            is_approval_widget = (
-                "elec" in widget_name or
-                "major" in widget_name or
-                "minor" in widget_name
-            )
-            if is_approval_widget:
-                # if looks like real initials/name (not generic yes/no)
-                has_signature = (
-                    widget_value
-                    and widget_value.lower() not in
-                    ["", "no", "n", "none", "yes", "y", "approved", "denied"]
-                    and len(widget_value.strip()) > 1
-                )
-                sig_rows.append({
-                    "Widget Name": w["name"],
-                    "Value": widget_value,
-                    "Page": w["page"],
-                    "Y Position": round(w["y0"], 1),
-                    "Type": "Elective" if "elec" in widget_name else "Major/Minor",
-                    "Has Signature (text)": has_signature
-                })
-        if sig_rows:
-            st.dataframe(pd.DataFrame(sig_rows), use_container_width=True)
-        else:
-            st.write("No approval widgets found.")
-
-        st.write("**Visual Signature Detection Results:**")
-        vis_map = detect_visual_signatures_in_pdf(pdf_bytes, widgets)
-        vis_rows = []
-        for widget_name, has_sig in vis_map.items():
-            low = widget_name.lower() if widget_name else ""
-            if "elec" in low or "major" in low or "minor" in low:
-                vis_rows.append({
-                    "Widget Name": widget_name,
-                    "Has Visual Signature": has_sig
-                })
-        if vis_rows:
-            st.dataframe(pd.DataFrame(vis_rows), use_container_width=True)
-        else:
-            st.write("No visual signatures detected.")
-
-with st.expander("Debug: Header & Raw Form Fields"):
-    st.write("Header inference:", all_headers[-1] if all_headers else {})
-    if 'pdf_bytes' in locals():
-        widgets, fields = read_form_widgets(pdf_bytes)
-        st.write("Raw field keys (sample):", list(fields.keys())[:50])
-    else:
-        st.write("No file processed.")
+        st.dataframe(combined_df.head(rows_shown), use_container_width=True)
+
+    # the debug expanders describe the last uploaded file. Streamlit runs an
+    # expander's body even while it is collapsed, so these track their open
+    # state (a rerun on toggle) and only build their tables once opened; the
+    # tables are cached per upload after that.
+    sig_expander = st.expander("Debug: Signature Detection Details", on_change="rerun")
+    if sig_expander.open:
+        debug_widgets_df, debug_sig_df, debug_vis_df = debug_tables(pdf_blobs[-1])
+        with sig_expander:
+            st.write("**All Widgets Found:**")
+            if not debug_widgets_df.empty:
+                st.dataframe(debug_widgets_df, use_container_width=True)
+            else:
+                st.write("No widgets found at all.")
+
+            st.write("**Approval Widgets (text-based signature guess):**")
+            if not debug_sig_df.empty:
+                st.dataframe(debug_sig_df, use_container_width=True)
+            else:
+                st.write("No approval widgets found.")
+
+            st.write("**Visual Signature Detection Results:**")
+            if not debug_vis_df.empty:
+                st.dataframe(debug_vis_df, use_container_width=True)
+            else:
+                st.write("No visual signatures detected.")
+
+header_expander = st.expander("Debug: Header & Raw Form Fields", on_change="rerun")
+if header_expander.open:
+    with header_expander:
+        st.write("Header inference:", all_headers[-1] if all_headers else {})
+        st.write("Raw field keys (sample):", debug_field_keys(pdf_blobs[-1]))